@@ -1,22 +1,118 @@
 import os
+import uuid
 import logging
-from flask import Flask, render_template, request, jsonify, session
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_session import Session
 from werkzeug.middleware.proxy_fix import ProxyFix
+from redis_client import get_redis
 from gigachat_model import GigaChatModel
 from seaart_service import SeaArtService
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
 
+class OrjsonProvider(JSONProvider):
+    """JSON-провайдер Flask на базе orjson
+
+    Сериализация и разбор JSON (jsonify, request.get_json) выполняются
+    на C-уровне — в разы быстрее stdlib json на больших ответах.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key-here")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.json = OrjsonProvider(app)
+
+# Серверное хранение сессий в Redis: в cookie остаётся только короткий
+# идентификатор сессии, а история чата живёт в Redis — без пересериализации
+# и подписи многокилобайтного cookie на каждый запрос
+session_redis = get_redis()
+if session_redis is not None:
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=session_redis,
+        SESSION_USE_SIGNER=False,
+        SESSION_PERMANENT=False
+    )
+    Session(app)
+    logging.info("Сессии хранятся в Redis (серверное хранение)")
+else:
+    logging.warning("Redis недоступен, сессии хранятся в cookie")
 
 # Initialize GigaChat model and SeaArt service
 ai_model = GigaChatModel()
 image_service = SeaArtService()
 
+# Фоновая генерация изображений: задача уходит в пул, браузер опрашивает
+# /api/image/<job_id>, воркеры не блокируются на внешних сервисах
+_IMAGE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='image-jobs')
+_image_jobs = {}  # запасное хранилище задач, когда Redis недоступен
+_IMAGE_JOB_TTL = 3600
+
+def store_image_job(job_id, payload):
+    """Сохранение состояния задачи генерации (Redis или память процесса)"""
+    r = get_redis()
+    if r is not None:
+        try:
+            r.setex(f'img_job:{job_id}', _IMAGE_JOB_TTL, orjson.dumps(payload))
+            return
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить задачу в Redis: {str(e)}")
+    _image_jobs[job_id] = payload
+
+def load_image_job(job_id):
+    """Чтение состояния задачи генерации"""
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(f'img_job:{job_id}')
+            if raw:
+                return orjson.loads(raw)
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать задачу из Redis: {str(e)}")
+    return _image_jobs.get(job_id)
+
+def run_image_job(job_id, prompt):
+    """Выполнение генерации изображения в фоновом потоке"""
+    try:
+        result = image_service.generate_image(prompt)
+        store_image_job(job_id, {'status': 'finished', 'result': result})
+    except Exception as e:
+        logging.error(f"Ошибка фоновой генерации изображения: {str(e)}")
+        store_image_job(job_id, {'status': 'failed'})
+
+def save_history(history):
+    """Запись истории чата в сессию одной операцией
+
+    Обрезка выполняется на месте (del среза) — без аллокации нового
+    списка на каждый ход диалога.
+    """
+    # Ограничиваем историю последними 20 сообщениями для экономии памяти
+    if len(history) > 20:
+        del history[:-20]
+    session['chat_history'] = history
+    session.modified = True
+
+def append_to_history(*messages):
+    """Добавление сообщений в историю чата одной записью в сессию
+
+    Читаем список один раз, дополняем локально и записываем обратно —
+    одна операция с хранилищем сессий вместо двух на каждый ход диалога.
+    """
+    history = session.get('chat_history', [])
+    history.extend(messages)
+    save_history(history)
+
 @app.route('/')
 def index():
     """Главная страница чата"""
@@ -34,78 +130,52 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Сообщение не может быть пустым'}), 400
         
-        # Получаем историю чата из сессии
-        if 'chat_history' not in session:
-            session['chat_history'] = []
-        
-        # Добавляем сообщение пользователя в историю
-        session['chat_history'].append({
+        # Получаем историю чата из сессии (читаем один раз)
+        chat_history = session.get('chat_history', [])
+
+        # Сообщение пользователя попадёт в историю вместе с ответом —
+        # одна запись в сессию на весь ход диалога
+        user_entry = {
             'role': 'user',
             'content': user_message
-        })
-        
+        }
+
         # Проверяем, не запрос ли это на генерацию изображения
         if image_service.is_image_generation_request(user_message):
             # Извлекаем промпт для генерации изображения
             image_prompt = image_service.extract_image_prompt(user_message)
-            
-            # Генерируем изображение
-            image_result = image_service.generate_image(image_prompt)
-            
-            if image_result['success']:
-                response_message = image_result['message']
-                
-                # Добавляем специальный ответ с изображением
-                session['chat_history'].append({
-                    'role': 'assistant',
-                    'content': response_message,
-                    'type': 'image',
-                    'image_url': image_result['image_url'],
-                    'prompt': image_result['prompt'],
-                    'service': image_result['service']
-                })
-                
-                session.modified = True
-                
-                logging.info(f"Отправляю изображение: {image_result['image_url']}")
-                
-                return jsonify({
-                    'response': response_message,
-                    'type': 'image',
-                    'image_url': image_result['image_url'],
-                    'prompt': image_result['prompt'],
-                    'service': image_result['service'],
-                    'status': 'success'
-                })
-            else:
-                error_message = image_result['message']
-                session['chat_history'].append({
-                    'role': 'assistant',
-                    'content': error_message
-                })
-                
-                session.modified = True
-                
-                return jsonify({
-                    'response': error_message,
-                    'status': 'error'
-                })
+
+            # Генерация уходит в фон: сразу возвращаем id задачи,
+            # браузер опрашивает /api/image/<job_id>
+            job_id = str(uuid.uuid4())
+            store_image_job(job_id, {'status': 'pending'})
+            _IMAGE_POOL.submit(run_image_job, job_id, image_prompt)
+
+            append_to_history(user_entry)
+
+            return jsonify({
+                'response': f'Генерирую изображение по запросу: "{image_prompt}"...',
+                'type': 'image_pending',
+                'job_id': job_id,
+                'status': 'pending'
+            })
         
         # Обычная генерация текстового ответа от AI
-        ai_response = ai_model.generate_response(user_message, session['chat_history'])
-        
-        # Добавляем ответ AI в историю
-        session['chat_history'].append({
+        chat_history.append(user_entry)
+
+        # Если история разрослась по токенам, старые ходы сжимаются
+        # в одно "воспоминание" вместо молчаливого отбрасывания
+        chat_history = ai_model.compact_history(chat_history)
+
+        ai_response = ai_model.generate_response(user_message, chat_history)
+
+        # Сохраняем историю вместе с ответом AI одной записью
+        chat_history.append({
             'role': 'assistant',
             'content': ai_response
         })
-        
-        # Ограничиваем историю последними 20 сообщениями для экономии памяти
-        if len(session['chat_history']) > 20:
-            session['chat_history'] = session['chat_history'][-20:]
-        
-        session.modified = True
-        
+        save_history(chat_history)
+
         return jsonify({
             'response': ai_response,
             'status': 'success'
@@ -118,6 +188,127 @@ def chat():
             'status': 'error'
         }), 500
 
+@app.route('/api/image/<job_id>', methods=['GET'])
+def image_job_status(job_id):
+    """Статус фоновой задачи генерации изображения"""
+    job = load_image_job(job_id)
+    if job is None:
+        return jsonify({'status': 'not_found'}), 404
+
+    if job['status'] == 'pending':
+        return jsonify({'status': 'pending'})
+
+    if job['status'] == 'failed':
+        return jsonify({
+            'status': 'error',
+            'response': 'Произошла ошибка при генерации изображения. Попробуйте еще раз.'
+        })
+
+    image_result = job['result']
+
+    # Результат дозаписывается в историю один раз — при первой выдаче
+    if not job.get('delivered'):
+        job['delivered'] = True
+        store_image_job(job_id, job)
+        if image_result['success']:
+            append_to_history({
+                'role': 'assistant',
+                'content': image_result['message'],
+                'type': 'image',
+                'image_url': image_result['image_url'],
+                'prompt': image_result['prompt'],
+                'service': image_result['service']
+            })
+            logging.info(f"Отправляю изображение: {image_result['image_url']}")
+        else:
+            append_to_history({
+                'role': 'assistant',
+                'content': image_result['message']
+            })
+
+    if image_result['success']:
+        return jsonify({
+            'status': 'finished',
+            'response': image_result['message'],
+            'type': 'image',
+            'image_url': image_result['image_url'],
+            'prompt': image_result['prompt'],
+            'service': image_result['service']
+        })
+
+    return jsonify({
+        'status': 'error',
+        'response': image_result['message']
+    })
+
+def flush_session():
+    """Дозапись сессии после начала стриминга
+
+    Штатное сохранение сессии происходит до отдачи тела ответа, поэтому
+    изменения, сделанные внутри генератора, сохраняем через интерфейс
+    сессий вручную. Работает при серверном хранении в Redis; при
+    cookie-сессиях дозапись невозможна.
+    """
+    try:
+        app.session_interface.save_session(app, session, app.response_class())
+    except Exception as e:
+        logging.warning(f"Не удалось дозаписать сессию после стриминга: {str(e)}")
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Потоковый вариант чата: ответ отдаётся SSE-кадрами по мере генерации"""
+    try:
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+
+        if not user_message:
+            return jsonify({'error': 'Сообщение не может быть пустым'}), 400
+
+        # Запросы на изображения стримить нечего — обычный JSON-ответ
+        if image_service.is_image_generation_request(user_message):
+            return chat()
+
+        chat_history = session.get('chat_history', [])
+        chat_history.append({
+            'role': 'user',
+            'content': user_message
+        })
+        chat_history = ai_model.compact_history(chat_history)
+
+        # Сообщение пользователя сохраняется до стриминга,
+        # ответ AI дозаписывается по завершении генерации
+        save_history(chat_history)
+
+        def generate():
+            parts = []
+            for chunk in ai_model.generate_response_stream(user_message, chat_history):
+                parts.append(chunk)
+                yield f"data: {orjson.dumps({'delta': chunk}).decode()}\n\n"
+
+            ai_response = ''.join(parts)
+            if ai_response:
+                chat_history.append({
+                    'role': 'assistant',
+                    'content': ai_response
+                })
+                save_history(chat_history)
+                flush_session()
+
+            yield "data: [DONE]\n\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        logging.error(f"Ошибка при потоковой обработке сообщения: {str(e)}")
+        return jsonify({
+            'error': 'Произошла ошибка при генерации ответа. Попробуйте еще раз.',
+            'status': 'error'
+        }), 500
+
 @app.route('/api/clear', methods=['POST'])
 def clear_chat():
     """Очистка истории чата"""
@@ -144,4 +335,4 @@ def image_status():
     return jsonify(status)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000)
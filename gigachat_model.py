@@ -1,32 +1,119 @@
 import os
 import requests
-import json
+import urllib3
+import orjson
 import uuid
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from redis_client import get_redis
 from search_service import SearchService
 
+# Пул для запуска поиска параллельно с другими сетевыми операциями
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='gigachat-search')
+
+# CA-бандл для хостов Сбера (Russian Trusted Root CA): при наличии
+# включаем полноценную проверку TLS и возобновление сессий. Без бандла
+# остаётся verify=False, но шумные InsecureRequestWarning (форматирование
+# трейсбека на каждый вызов) гасятся один раз на процесс
+_CA_BUNDLE = os.environ.get(
+    "GIGACHAT_CA_BUNDLE",
+    os.path.join(os.path.dirname(__file__), "certs", "russian_trusted_root.pem")
+)
+if os.path.exists(_CA_BUNDLE):
+    _VERIFY = _CA_BUNDLE
+else:
+    _VERIFY = False
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Ключи для общего кэша токена в Redis (один токен на все воркеры)
+_TOKEN_KEY = 'gigachat:token'
+_TOKEN_LOCK_KEY = 'gigachat:refresh_lock'
+_TOKEN_TTL = 25 * 60  # секунд; сам токен живёт 30 минут
+
 class GigaChatModel:
     def __init__(self):
         self.api_key = os.environ.get("GIGACHAT_API_KEY")
         self.access_token = None
         self.token_expires_at = None
         self.base_url = "https://gigachat.devices.sberbank.ru/api/v1"
-        
+
+        # Постоянная HTTP-сессия с пулом соединений: TCP+TLS рукопожатие
+        # к Сберу (~100-300 мс) выполняется один раз, а не на каждый запрос
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(total=2, backoff_factor=0.2)
+        )
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        self.http.headers.update({'Accept': 'application/json'})
+        self.http.verify = _VERIFY
+
+        # Прогреваем соединения к хостам Сбера в фоне: первый реальный
+        # запрос не платит за TCP+TLS рукопожатие
+        threading.Thread(target=self._warm_connections, daemon=True).start()
+
         # Инициализируем сервис поиска
         self.search_service = SearchService()
         
+        # Токен не запрашиваем при старте: _ensure_valid_token получит его
+        # при первом обращении, и запуск воркера не зависит от доступности
+        # Сбера (а пачка воркеров не устраивает OAuth-шторм на старте)
         if not self.api_key:
             logging.error("GIGACHAT_API_KEY не найден в переменных окружения")
             self.model_loaded = False
         else:
             logging.info("Инициализация GigaChat...")
             self.model_loaded = True
-            self._get_access_token()
     
+    def _warm_connections(self):
+        """Установка keep-alive соединений к API и OAuth хостам заранее"""
+        for url in (self.base_url, "https://ngw.devices.sberbank.ru:9443"):
+            try:
+                self.http.head(url, timeout=5)
+            except Exception:
+                pass
+
+    def _load_token_from_redis(self):
+        """Попытка взять токен из общего кэша в Redis"""
+        r = get_redis()
+        if r is None:
+            return False
+        try:
+            cached = r.get(_TOKEN_KEY)
+            if cached:
+                self.access_token = cached.decode()
+                ttl = r.ttl(_TOKEN_KEY) or 0
+                self.token_expires_at = datetime.now() + timedelta(seconds=max(ttl, 0))
+                return True
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать токен из Redis: {str(e)}")
+        return False
+
     def _get_access_token(self):
         """Получение токена доступа для GigaChat API"""
+        r = get_redis()
+
+        # Single-flight через Redis: при одновременном истечении токена
+        # OAuth-запрос делает только один воркер, остальные ждут результат
+        if r is not None:
+            try:
+                if not r.set(_TOKEN_LOCK_KEY, '1', nx=True, px=5000):
+                    for _ in range(50):
+                        time.sleep(0.1)
+                        if self._load_token_from_redis():
+                            return True
+                    # Обновляющий воркер не успел — получаем токен сами
+            except Exception as e:
+                logging.warning(f"Redis недоступен для блокировки токена: {str(e)}")
+
         try:
             url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
             
@@ -41,13 +128,22 @@ class GigaChatModel:
                 'scope': 'GIGACHAT_API_PERS'
             }
             
-            response = requests.post(url, headers=headers, data=data, verify=False)
+            response = self.http.post(url, headers=headers, data=data)
             
             if response.status_code == 200:
-                token_data = response.json()
+                token_data = orjson.loads(response.content)
                 self.access_token = token_data['access_token']
                 # Токен действует 30 минут
                 self.token_expires_at = datetime.now() + timedelta(minutes=25)
+
+                # Делимся токеном с остальными воркерами
+                if r is not None:
+                    try:
+                        r.setex(_TOKEN_KEY, _TOKEN_TTL, self.access_token)
+                        r.delete(_TOKEN_LOCK_KEY)
+                    except Exception as e:
+                        logging.warning(f"Не удалось сохранить токен в Redis: {str(e)}")
+
                 logging.info("GigaChat токен получен успешно")
                 return True
             else:
@@ -61,6 +157,9 @@ class GigaChatModel:
     def _ensure_valid_token(self):
         """Проверка и обновление токена при необходимости"""
         if not self.access_token or (self.token_expires_at and datetime.now() >= self.token_expires_at):
+            # Сначала пробуем общий кэш — возможно, другой воркер уже обновил токен
+            if self._load_token_from_redis():
+                return True
             return self._get_access_token()
         return True
     
@@ -68,28 +167,23 @@ class GigaChatModel:
         """Генерация ответа от GigaChat с поиском в интернете"""
         if not self.model_loaded:
             return "Ошибка: GigaChat API не настроен. Проверьте API ключ."
-        
-        if not self._ensure_valid_token():
-            return "Ошибка авторизации в GigaChat. Проверьте API ключ."
-        
-        # Проверяем, нужен ли поиск в интернете
-        search_result = None
+
+        # Запускаем поиск параллельно с проверкой токена: это две
+        # независимые сетевые операции, и общее время становится max() вместо sum()
+        search_future = None
         if self.search_service.should_search(user_message):
             logging.info(f"Выполняется поиск в интернете для: {user_message}")
-            search_result = self.search_service.search(user_message)
-        
+            search_future = _SEARCH_POOL.submit(self.search_service.search, user_message)
+
+        if not self._ensure_valid_token():
+            return "Ошибка авторизации в GigaChat. Проверьте API ключ."
+
+        search_result = search_future.result() if search_future else None
+
         try:
             # Подготавливаем сообщения для API
             messages = self._prepare_messages(user_message, chat_history, search_result)
-            
-            url = f"{self.base_url}/chat/completions"
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': f'Bearer {self.access_token}'
-            }
-            
+
             payload = {
                 "model": "GigaChat",
                 "messages": messages,
@@ -99,11 +193,13 @@ class GigaChatModel:
                 "stream": False,
                 "update_interval": 0
             }
-            
-            response = requests.post(url, headers=headers, json=payload, verify=False)
-            
+
+            # Прямой запрос через общий пул keep-alive соединений:
+            # одновременные обращения не ограничены ничем, кроме пула
+            response = self._post_completion(payload)
+
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 if 'choices' in result and len(result['choices']) > 0:
                     ai_response = result['choices'][0]['message']['content'].strip()
                     
@@ -118,36 +214,171 @@ class GigaChatModel:
         except Exception as e:
             logging.error(f"Ошибка при обращении к GigaChat: {str(e)}")
             return "Произошла ошибка при генерации ответа. Попробуйте еще раз."
-    
+
+    def generate_response_stream(self, user_message, chat_history=None):
+        """Потоковая генерация ответа от GigaChat
+
+        Выдаёт текст по мере прихода SSE-чанков от API: время до первого
+        токена равно началу генерации, а не её окончанию.
+        """
+        if not self.model_loaded:
+            yield "Ошибка: GigaChat API не настроен. Проверьте API ключ."
+            return
+
+        # Поиск параллельно с проверкой токена, как и в обычной генерации
+        search_future = None
+        if self.search_service.should_search(user_message):
+            logging.info(f"Выполняется поиск в интернете для: {user_message}")
+            search_future = _SEARCH_POOL.submit(self.search_service.search, user_message)
+
+        if not self._ensure_valid_token():
+            yield "Ошибка авторизации в GigaChat. Проверьте API ключ."
+            return
+
+        search_result = search_future.result() if search_future else None
+
+        try:
+            messages = self._prepare_messages(user_message, chat_history, search_result)
+
+            url = f"{self.base_url}/chat/completions"
+
+            headers = {
+                'Content-Type': 'application/json',
+                'Accept': 'application/json',
+                'Authorization': f'Bearer {self.access_token}'
+            }
+
+            payload = {
+                "model": "GigaChat",
+                "messages": messages,
+                "temperature": 0.7,
+                "max_tokens": 512,
+                "n": 1,
+                "stream": True,
+                "update_interval": 0
+            }
+
+            response = self.http.post(url, headers=headers, data=orjson.dumps(payload),
+                                      stream=True)
+
+            if response.status_code != 200:
+                logging.error(f"Ошибка GigaChat API: {response.status_code} - {response.text}")
+                yield f"Ошибка API GigaChat: {response.status_code}"
+                return
+
+            # Разбираем SSE-кадры вида "data: {...}" до "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == '[DONE]':
+                    break
+                try:
+                    delta = orjson.loads(chunk)['choices'][0]['delta'].get('content', '')
+                except (KeyError, IndexError, ValueError):
+                    continue
+                if delta:
+                    yield delta
+
+        except Exception as e:
+            logging.error(f"Ошибка при потоковом обращении к GigaChat: {str(e)}")
+            yield "Произошла ошибка при генерации ответа. Попробуйте еще раз."
+
+    def _post_completion(self, payload):
+        """Отправка одного запроса к /chat/completions"""
+        url = f"{self.base_url}/chat/completions"
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.access_token}'
+        }
+
+        return self.http.post(url, headers=headers, data=orjson.dumps(payload), timeout=90)
+
+    def _estimate_tokens(self, chat_history):
+        """Грубая оценка числа токенов в истории (~4 символа на токен)"""
+        return sum(len(m.get('content', '')) // 4 for m in chat_history)
+
+    def compact_history(self, chat_history, token_budget=1500):
+        """Сжатие старых ходов диалога в одно "воспоминание"
+
+        Когда оценка токенов превышает бюджет, всё кроме последних 10
+        сообщений суммаризуется дешёвым вызовом GigaChat и заменяется
+        одним системным сообщением-памятью; свежие ходы остаются дословно.
+        """
+        if not chat_history or self._estimate_tokens(chat_history) <= token_budget:
+            return chat_history
+
+        old, recent = chat_history[:-10], chat_history[-10:]
+        if not old or not self._ensure_valid_token():
+            return chat_history
+
+        try:
+            dialog = "\n".join(
+                f"{m['role']}: {m['content']}" for m in old if m.get('content')
+            )
+            payload = {
+                "model": "GigaChat",
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": "Сожми диалог в краткое резюме из 3-4 предложений, сохранив важные факты о пользователе и теме разговора."
+                    },
+                    {"role": "user", "content": dialog}
+                ],
+                "temperature": 0.3,
+                "max_tokens": 128,
+                "stream": False
+            }
+
+            response = self._post_completion(payload)
+
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                if 'choices' in result and len(result['choices']) > 0:
+                    summary = result['choices'][0]['message']['content'].strip()
+                    memory = {
+                        'role': 'system',
+                        'content': f"Краткое содержание предыдущего разговора: {summary}"
+                    }
+                    logging.info("История диалога сжата в резюме")
+                    return [memory] + recent
+
+        except Exception as e:
+            logging.warning(f"Не удалось сжать историю диалога: {str(e)}")
+
+        return chat_history
+
     def _prepare_messages(self, user_message, chat_history=None, search_result=None):
         """Подготовка сообщений для GigaChat API"""
         messages = []
-        
+
         # Системное сообщение с учетом поиска
         system_content = "Ты полезный AI-ассистент. Отвечай на русском языке кратко и по существу."
         if search_result:
             system_content = "Ты AI-ассистент с доступом к актуальной информации из интернета. Тебе предоставлены свежие данные из надёжных источников. ВАЖНО: Используй ТОЛЬКО предоставленную актуальную информацию для ответа. Не говори, что у тебя нет доступа к интернету - у тебя есть актуальные данные!"
-        
+
         messages.append({
             "role": "system",
             "content": system_content
         })
-        
-        # Добавляем историю чата (последние 10 сообщений)
+
+        # Добавляем историю чата (последние 10 сообщений) одним проходом
+        # без промежуточных срезов; "воспоминание" после сжатия истории
+        # сохраняется, даже если оно вышло за пределы окна
         if chat_history:
-            recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-            
-            for message in recent_history:
-                if message['role'] == 'user':
-                    messages.append({
-                        "role": "user",
-                        "content": message['content']
-                    })
-                elif message['role'] == 'assistant':
-                    messages.append({
-                        "role": "assistant",
-                        "content": message['content']
-                    })
+            start = max(len(chat_history) - 10, 0)
+            if start > 0 and chat_history[0].get('role') == 'system':
+                messages.append({
+                    "role": "system",
+                    "content": chat_history[0]['content']
+                })
+            messages.extend(
+                {"role": m['role'], "content": m['content']}
+                for m in islice(chat_history, start, None)
+                if m.get('role') in ('system', 'user', 'assistant') and m.get('content')
+            )
         
         # Формируем текущее сообщение
         current_message = user_message
@@ -169,12 +400,6 @@ class GigaChatModel:
                 'message': 'API ключ не настроен'
             }
         
-        if not self.access_token:
-            return {
-                'status': 'loading',
-                'message': 'Получение токена доступа...'
-            }
-        
         return {
             'status': 'ready',
             'message': 'GigaChat готов к работе',
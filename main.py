@@ -1,4 +1,11 @@
+
+# Патчим стандартную библиотеку до остальных импортов: блокирующие
+# сетевые вызовы (requests к GigaChat, поиску, генерации изображений)
+# становятся кооперативными и не держат воркер на время ожидания I/O
+from gevent import monkey
+monkey.patch_all()
+
 from app import app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,25 @@
+import os
+import logging
+import redis
+
+# Общий Redis-клиент приложения: один пул соединений на процесс,
+# используется для сессий, кэшей и межворкерной координации
+_client = None
+_checked = False
+
+def get_redis():
+    """Возвращает общий Redis-клиент или None, если Redis недоступен"""
+    global _client, _checked
+    if not _checked:
+        _checked = True
+        try:
+            client = redis.Redis.from_url(
+                os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+                socket_keepalive=True
+            )
+            client.ping()
+            _client = client
+            logging.info("Redis подключен")
+        except Exception as e:
+            logging.warning(f"Redis недоступен ({e}) — кэширование между воркерами отключено")
+    return _client
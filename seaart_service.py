@@ -1,9 +1,33 @@
 import requests
-import json
+import orjson
 import logging
 import time
 import re
+import hashlib
+import threading
 from urllib.parse import urlparse, quote
+from redis_client import get_redis
+
+# Интервал фонового обновления доступности внешних сервисов (секунд)
+_HEALTH_INTERVAL = 30
+
+# Время жизни кэша готовых изображений по промпту (секунд)
+_IMAGE_CACHE_TTL = 86400
+
+# Ключевые слова, по которым распознаётся запрос на генерацию изображения
+_IMAGE_KEYWORDS = (
+    'нарисуй', 'создай изображение', 'сгенерируй картинку', 'создай картинку',
+    'нарисовать', 'изобрази', 'покажи как выглядит', 'визуализируй',
+    '/generate', '/img', '/image', '/draw', '/создай', '/нарисуй',
+    'картинка', 'рисунок', 'изображение', 'фото', 'арт', 'иллюстрация'
+)
+
+# Команды и обороты, которые вырезаются из сообщения при извлечении промпта
+_PROMPT_COMMANDS = (
+    '/generate', '/img', '/image', '/draw', '/создай', '/нарисуй',
+    'нарисуй', 'создай изображение', 'сгенерируй картинку', 'создай картинку',
+    'нарисовать', 'изобрази', 'покажи как выглядит', 'визуализируй'
+)
 
 class SeaArtService:
     """
@@ -21,56 +45,97 @@ class SeaArtService:
             'Accept-Language': 'en-US,en;q=0.9,ru;q=0.8',
             'Content-Type': 'application/json'
         })
+
+        # Предкомпилированные шаблоны: один проход по сообщению на C-уровне
+        # вместо поочерёдного Python-сканирования по каждому ключевому слову
+        self._image_re = re.compile(
+            '|'.join(map(re.escape, _IMAGE_KEYWORDS)), re.IGNORECASE
+        )
+        # Длинные обороты идут первыми, чтобы "создай изображение"
+        # вырезалось целиком, а не частично
+        self._commands_re = re.compile(
+            r'\b(?:' + '|'.join(
+                re.escape(c) for c in sorted(_PROMPT_COMMANDS, key=len, reverse=True)
+            ) + r')\b',
+            re.IGNORECASE
+        )
+
+        # Доступность сервисов обновляется фоновым потоком: в горячем пути
+        # генерации нет сетевых проверок. До первой проверки считаем
+        # сервисы доступными
+        self._pollinations_up = True
+        self._picsum_up = True
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
         logging.info("SeaArt AI сервис инициализирован")
-    
+
+    def _probe(self, url, timeout=5):
+        """Проверка доступности внешнего сервиса одним HEAD-запросом"""
+        try:
+            return self.session.head(url, timeout=timeout).status_code == 200
+        except Exception:
+            return False
+
+    def _health_loop(self):
+        """Фоновое обновление флагов доступности сервисов генерации"""
+        while True:
+            self._pollinations_up = self._probe(
+                "https://image.pollinations.ai/prompt/test?width=64&height=64"
+            )
+            self._picsum_up = self._probe("https://picsum.photos/64")
+            time.sleep(_HEALTH_INTERVAL)
+
     def is_image_generation_request(self, message):
         """
         Определяем, является ли сообщение запросом на генерацию изображения
         """
-        image_keywords = [
-            'нарисуй', 'создай изображение', 'сгенерируй картинку', 'создай картинку',
-            'нарисовать', 'изобрази', 'покажи как выглядит', 'визуализируй',
-            '/generate', '/img', '/image', '/draw', '/создай', '/нарисуй',
-            'картинка', 'рисунок', 'изображение', 'фото', 'арт', 'иллюстрация'
-        ]
-        
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in image_keywords)
-    
+        return bool(self._image_re.search(message))
+
     def extract_image_prompt(self, message):
         """
         Извлекаем промпт для генерации изображения из сообщения пользователя
         """
-        # Удаляем команды и ключевые слова
-        commands_to_remove = [
-            '/generate', '/img', '/image', '/draw', '/создай', '/нарисуй',
-            'нарисуй', 'создай изображение', 'сгенерируй картинку', 'создай картинку',
-            'нарисовать', 'изобрази', 'покажи как выглядит', 'визуализируй'
-        ]
-        
-        prompt = message.strip()
-        for command in commands_to_remove:
-            prompt = re.sub(rf'\b{re.escape(command)}\b', '', prompt, flags=re.IGNORECASE)
-        
+        # Удаляем команды и ключевые слова одним проходом
+        prompt = self._commands_re.sub('', message.strip())
+
         # Очищаем от лишних пробелов и знаков препинания в начале
         prompt = prompt.strip(' ,:.-')
-        
+
         return prompt if prompt else "красивый пейзаж"
     
     def generate_image_fallback(self, prompt):
         """
         Альтернативный метод генерации изображений через бесплатные сервисы
-        Используем Pollinations.ai как бесплатную альтернативу
+        Доступность берётся из фонового health-чека, поэтому URL
+        возвращается сразу, без сетевых проверок в горячем пути
+        """
+        result = self._generate_via_pollinations(prompt)
+        if result:
+            return result
+
+        # Основной сервис недоступен — используем резервный
+        return self._generate_via_picsum(prompt)
+
+    def _generate_via_pollinations(self, prompt):
         """
+        Генерация изображения через Pollinations.ai (основной сервис)
+        """
+        if not self._pollinations_up:
+            logging.warning("Pollinations.ai недоступен по данным health-чека")
+            return None
+
         try:
             # Pollinations.ai - полностью бесплатный сервис генерации изображений
             pollinations_url = f"https://image.pollinations.ai/prompt/{quote(prompt)}"
             
-            # Добавляем параметры для улучшения качества
+            # Добавляем параметры для улучшения качества; seed выводится
+            # из промпта, чтобы одинаковый запрос давал одинаковый URL
+            # и попадал в кэш
             params = {
                 'width': 1024,
                 'height': 1024,
-                'seed': int(time.time()),
+                'seed': int(hashlib.sha1(prompt.encode()).hexdigest()[:8], 16),
                 'enhance': 'true'
             }
             
@@ -79,54 +144,30 @@ class SeaArtService:
             image_url = f"{pollinations_url}?{param_string}"
             
             logging.info(f"Генерация изображения через Pollinations.ai для промпта: {prompt}")
-            
-            # Проверяем доступность изображения
-            response = requests.head(image_url, timeout=10)
-            if response.status_code == 200:
-                return {
-                    'success': True,
-                    'image_url': image_url,
-                    'prompt': prompt,
-                    'service': 'Pollinations.ai',
-                    'message': f'Изображение создано по запросу: "{prompt}"'
-                }
-            else:
-                logging.warning(f"Pollinations.ai недоступен: {response.status_code}")
-                
+
+            return {
+                'success': True,
+                'image_url': image_url,
+                'prompt': prompt,
+                'service': 'Pollinations.ai',
+                'message': f'Изображение создано по запросу: "{prompt}"'
+            }
+
         except Exception as e:
             logging.error(f"Ошибка при генерации изображения через Pollinations.ai: {str(e)}")
-        
-        # Если основной сервис недоступен, используем резервный
-        return self._generate_via_picsum(prompt)
+
+        return None
     
     def _generate_via_picsum(self, prompt):
         """
         Резервный метод через Lorem Picsum с тематическими изображениями
         """
         try:
-            # Анализируем промпт для выбора подходящей категории
-            categories = {
-                'природа': ['nature', 'landscape', 'forest', 'mountain'],
-                'животные': ['animal', 'cat', 'dog', 'wildlife'],
-                'город': ['city', 'urban', 'building', 'street'],
-                'море': ['ocean', 'sea', 'beach', 'water'],
-                'небо': ['sky', 'cloud', 'sunset', 'sunrise']
-            }
-            
-            # Определяем категорию по ключевым словам в промпте
-            category = 'nature'  # по умолчанию
-            prompt_lower = prompt.lower()
-            for cat, keywords in categories.items():
-                if any(keyword in prompt_lower for keyword in keywords + [cat]):
-                    category = keywords[0]
-                    break
-            
             # Используем прямую генерацию через Picsum для стабильности
             picsum_url = f"https://picsum.photos/1024/1024?random={int(time.time())}"
-            
-            # Проверяем доступность
-            response = requests.head(picsum_url, timeout=5)
-            if response.status_code == 200:
+
+            # Доступность известна из фонового health-чека
+            if self._picsum_up:
                 return {
                     'success': True,
                     'image_url': picsum_url,
@@ -163,16 +204,36 @@ class SeaArtService:
                 'error': 'Слишком короткий промпт',
                 'message': 'Пожалуйста, опишите более подробно, что вы хотите увидеть на изображении'
             }
-        
+
+        # Кэш по хэшу промпта: повторный запрос возвращается мгновенно
+        cache_key = 'img:' + hashlib.sha1(prompt.encode()).hexdigest()
+        r = get_redis()
+        if r is not None:
+            try:
+                cached = r.get(cache_key)
+                if cached:
+                    logging.info(f"Изображение взято из кэша для промпта: {prompt}")
+                    return orjson.loads(cached)
+            except Exception as e:
+                logging.warning(f"Не удалось прочитать кэш изображений: {str(e)}")
+
         # Сначала пробуем основной метод
         result = self.generate_image_fallback(prompt)
-        
+
         # Логируем результат
         if result['success']:
             logging.info(f"Изображение успешно сгенерировано: {result['service']}")
+            # Кэшируем только настоящую генерацию: случайная картинка
+            # Picsum и заглушка тоже приходят с success=True, но сутки
+            # отдавать их из кэша после восстановления Pollinations нельзя
+            if r is not None and result.get('service') == 'Pollinations.ai':
+                try:
+                    r.setex(cache_key, _IMAGE_CACHE_TTL, orjson.dumps(result))
+                except Exception as e:
+                    logging.warning(f"Не удалось сохранить кэш изображений: {str(e)}")
         else:
             logging.error(f"Не удалось сгенерировать изображение: {result.get('error', 'Неизвестная ошибка')}")
-        
+
         return result
     
     def enhance_prompt(self, user_prompt):
@@ -197,27 +258,22 @@ class SeaArtService:
     
     def get_service_status(self):
         """
-        Проверка статуса сервиса
+        Проверка статуса сервиса по кэшированному фоновому health-чеку —
+        опрос /api/image_status не порождает внешних запросов
         """
-        try:
-            # Проверяем доступность Pollinations.ai
-            test_url = "https://image.pollinations.ai/prompt/test?width=64&height=64"
-            response = requests.head(test_url, timeout=5)
-            
-            if response.status_code == 200:
-                return {
-                    'status': 'online',
-                    'service': 'Pollinations.ai + Unsplash',
-                    'message': 'Сервисы генерации изображений доступны'
-                }
-            else:
-                return {
-                    'status': 'limited',
-                    'service': 'Unsplash only',
-                    'message': 'Основной сервис недоступен, работаем через резервные'
-                }
-                
-        except Exception as e:
+        if self._pollinations_up:
+            return {
+                'status': 'online',
+                'service': 'Pollinations.ai + Unsplash',
+                'message': 'Сервисы генерации изображений доступны'
+            }
+        elif self._picsum_up:
+            return {
+                'status': 'limited',
+                'service': 'Unsplash only',
+                'message': 'Основной сервис недоступен, работаем через резервные'
+            }
+        else:
             return {
                 'status': 'offline',
                 'service': 'None',
@@ -1,17 +1,227 @@
 import os
-import requests
+import time
+import random
+import asyncio
+import functools
+import threading
+import httpx
 import json
+import orjson
 import logging
 import urllib.parse
+from io import BytesIO
+from cachetools import TTLCache
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from typing import Optional, Dict, Any
 import re
 
+# Общий пул для параллельного опроса провайдеров поиска
+_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix='search')
+
+# Статусы, при которых имеет смысл повторить запрос
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Предохранители провайдеров: после стольких подряд сбоев провайдер
+# пропускается на время cooldown, чтобы не ждать таймаут деградировавшего
+# API на каждом запросе
+_BREAKER_FAILS = 5
+_BREAKER_COOLDOWN = 60
+
+def _decode_json(response):
+    """Разбор JSON-ответа через orjson (C-уровень, в разы быстрее stdlib)
+
+    На экзотических ответах, которые orjson не принимает, откатываемся
+    на стандартный json.
+    """
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        return json.loads(response.content)
+
+# Словарь городов для определения места в погодных запросах:
+# ключ — упоминание в тексте, значение — (название для API, название для ответа)
+_CITIES_MAP = {
+    # Основные города
+    "москва": ("Moscow", "Москве"),
+    "moscow": ("Moscow", "Москве"),
+    "питер": ("Saint Petersburg", "Санкт-Петербурге"),
+    "спб": ("Saint Petersburg", "Санкт-Петербурге"),
+    "санкт-петербург": ("Saint Petersburg", "Санкт-Петербурге"),
+    "екатеринбург": ("Yekaterinburg", "Екатеринбурге"),
+    "новосибирск": ("Novosibirsk", "Новосибирске"),
+    "казань": ("Kazan", "Казани"),
+    "казан": ("Kazan", "Казани"),
+    "ростов": ("Rostov-on-Don", "Ростове-на-Дону"),
+    "краснодар": ("Krasnodar", "Краснодаре"),
+    "тула": ("Tula", "Туле"),
+    "туле": ("Tula", "Туле"),
+    "новомосковск": ("Novomoskovsk", "Новомосковске"),
+    "якутск": ("Yakutsk", "Якутске"),
+    "якутии": ("Yakutsk", "Якутии"),
+    "мурманск": ("Murmansk", "Мурманске"),
+    # Дальневосточные города
+    "усурийск": ("Ussuriysk", "Усурийске"),
+    "владивосток": ("Vladivostok", "Владивостоке"),
+    "хабаровск": ("Khabarovsk", "Хабаровске"),
+    "благовещенск": ("Blagoveshchensk", "Благовещенске"),
+    "южно-сахалинск": ("Yuzhno-Sakhalinsk", "Южно-Сахалинске"),
+    "петропавловск-камчатский": ("Petropavlovsk-Kamchatsky", "Петропавловске-Камчатском"),
+    # Сибирские города
+    "омск": ("Omsk", "Омске"),
+    "красноярск": ("Krasnoyarsk", "Красноярске"),
+    "барнаул": ("Barnaul", "Барнауле"),
+    "кемерово": ("Kemerovo", "Кемерово"),
+    "томск": ("Tomsk", "Томске"),
+    "иркутск": ("Irkutsk", "Иркутске"),
+    "улан-удэ": ("Ulan-Ude", "Улан-Удэ"),
+    "чита": ("Chita", "Чите"),
+    # Южные города
+    "волгоград": ("Volgograd", "Волгограде"),
+    "сочи": ("Sochi", "Сочи"),
+    "ставрополь": ("Stavropol", "Ставрополе"),
+    "астрахань": ("Astrakhan", "Астрахани"),
+    # Поволжье
+    "нижний новгород": ("Nizhny Novgorod", "Нижнем Новгороде"),
+    "самара": ("Samara", "Самаре"),
+    "уфа": ("Ufa", "Уфе"),
+    "пермь": ("Perm", "Перми"),
+    "саратов": ("Saratov", "Саратове"),
+    # Центральные города
+    "воронеж": ("Voronezh", "Воронеже"),
+    "тверь": ("Tver", "Твери"),
+    "ярославль": ("Yaroslavl", "Ярославле"),
+    "рязань": ("Ryazan", "Рязани")
+}
+
+# Один скомпилированный шаблон вместо перебора всех ключей: запрос
+# сканируется единственным проходом на C-уровне. Варианты в порядке
+# убывания длины, чтобы "санкт-петербург" выигрывал у "питер" внутри него
+_CITY_RE = re.compile(
+    '|'.join(re.escape(k) for k in sorted(_CITIES_MAP, key=len, reverse=True))
+)
+
+# Ключевые слова, указывающие на необходимость поиска
+_SEARCH_INDICATORS = (
+    # Временные индикаторы
+    "последние новости", "свежие новости", "что происходит",
+    "актуальная информация", "сегодня", "вчера", "недавно",
+    "текущий", "сейчас", "в настоящее время", "на данный момент",
+    "2024", "2025", "этот год", "в этом году", "в прошлом году",
+
+    # Финансовая и экономическая информация
+    "курс", "цена", "стоимость", "котировки", "биржа", "акции",
+    "криптовалюта", "биткоин", "доллар", "евро", "рубль",
+    "инфляция", "экономика", "ВВП", "бюджет",
+
+    # Погода и география
+    "погода", "прогноз", "температура", "климат", "дождь", "снег",
+    "ветер", "давление", "влажность",
+
+    # Новости и события
+    "что нового", "обновления", "изменения", "события", "произошло",
+    "случилось", "новость", "сообщают", "объявили", "заявили",
+
+    # Информационные запросы
+    "что такое", "кто такой", "определение", "история", "биография",
+    "расскажи о", "информация о", "данные о", "статистика",
+    "рейтинг", "топ", "список", "обзор",
+
+    # Технологии и наука
+    "последняя версия", "обновление", "выпуск", "релиз",
+    "исследование", "открытие", "изобретение", "патент",
+
+    # Спорт и культура
+    "результаты", "счет", "матч", "игра", "чемпионат",
+    "фильм", "сериал", "книга", "музыка", "премьера",
+
+    # Места и организации
+    "работает", "открыт", "закрыт", "расписание", "адрес",
+    "телефон", "сайт", "контакты", "время работы"
+)
+
+# Триггеры специализированных провайдеров
+_WEATHER_WORDS = ('погода', 'температура', 'прогноз', 'климат')
+_WIKI_WORDS = ('что такое', 'кто такой', 'определение', 'история')
+
+# Предкомпилированные триггеры: одно сканирование сообщения на
+# C-уровне вместо ~90 Python-проверок подстрок на каждый ход диалога
+_SEARCH_RE = re.compile(
+    '|'.join(sorted(map(re.escape, _SEARCH_INDICATORS), key=len, reverse=True)),
+    re.IGNORECASE
+)
+_WEATHER_RE = re.compile('|'.join(_WEATHER_WORDS), re.IGNORECASE)
+_WIKI_RE = re.compile('|'.join(_WIKI_WORDS), re.IGNORECASE)
+
+# Статичная часть запроса к Perplexity: меняется только сообщение
+# пользователя, остальное не пересобирается на каждый вызов
+_PERPLEXITY_BASE = {
+    "model": "llama-3.1-sonar-small-128k-online",
+    "messages": [
+        {
+            "role": "system",
+            "content": "Ты помощник для поиска актуальной информации. Отвечай кратко и точно на русском языке."
+        }
+    ],
+    "max_tokens": 500,
+    "temperature": 0.2,
+    "top_p": 0.9,
+    "return_images": False,
+    "return_related_questions": False,
+    "search_recency_filter": "month",
+    "stream": False
+}
+
+# Таблица маршрутизации: специализированные запросы уходят сразу к
+# профильному провайдеру, минуя платный каскад
+_DISPATCH = (
+    (_WEATHER_RE, '_search_weather_info'),
+    (_WIKI_RE, '_search_wikipedia'),
+)
+
 class SearchService:
     def __init__(self):
         self.perplexity_api_key = os.environ.get("PERPLEXITY_API_KEY")
         self.yandex_api_key = os.environ.get("YANDEX_SEARCH_API_KEY")
         self.enabled = True  # Всегда включен - используем бесплатные источники
-        
+
+        # Один HTTP-клиент с пулом keep-alive соединений на все провайдеры:
+        # повторные запросы к одним хостам не платят за TCP+TLS рукопожатие.
+        # HTTP/2 мультиплексирует параллельные запросы к Wikipedia и
+        # Perplexity по одному соединению и сжимает заголовки (HPACK)
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=32),
+            # Быстрый отказ: 3с на соединение, 10с на чтение — медленный
+            # провайдер не растягивает весь search() до большого таймаута
+            timeout=httpx.Timeout(10.0, connect=3.05),
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            }
+        )
+
+        # Кэш готовых результатов: повторные одинаковые запросы возвращаются
+        # за доли миллисекунды и не дёргают бесплатные API (которые быстро
+        # начинают отвечать 429). Wikipedia кэшируется дольше — статьи
+        # меняются редко
+        # Погода кэшируется по городу: wttr.in жёстко лимитирует
+        # бесплатных клиентов, а погода не меняется чаще десятков минут
+        self._search_cache = TTLCache(maxsize=1024, ttl=300)
+        self._wiki_cache = TTLCache(maxsize=512, ttl=86400)
+        self._weather_cache = TTLCache(maxsize=256, ttl=600)
+        self._cache_lock = threading.RLock()
+
+        # Выполняющиеся прямо сейчас запросы: одинаковые одновременные
+        # запросы склеиваются в один опрос провайдеров (single-flight)
+        self._inflight: Dict[str, Future] = {}
+
+        # Состояние предохранителей по провайдерам
+        self._breakers = {
+            name: {'fails': 0, 'open_until': 0.0}
+            for name in ('perplexity', 'yandex', 'ddg', 'wiki', 'wttr')
+        }
+        self._breaker_lock = threading.Lock()
+
         available_services = ["DuckDuckGo", "Wikipedia"]
         if self.perplexity_api_key:
             available_services.append("Perplexity")
@@ -19,50 +229,216 @@ class SearchService:
             available_services.append("Яндекс.Поиск")
             
         logging.info(f"Поиск в интернете включен: {', '.join(available_services)}")
-    
+
+    def __del__(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
     def search(self, query: str) -> Optional[str]:
         """Поиск информации в интернете через бесплатные источники"""
         if not self.enabled:
             return None
-        
-        # Сначала пробуем платные API если есть ключи
+
+        # Нормализуем запрос один раз: query.lower() не пересчитывается
+        # в проверках триггеров и определении города
+        query_lower = query.lower()
+
+        # Сначала проверяем кэш результатов; под тем же замком решаем,
+        # кто выполняет запрос: первый вызвавший опрашивает провайдеров,
+        # остальные с тем же ключом ждут его результат
+        key = query_lower.strip()
+        with self._cache_lock:
+            cached = self._search_cache.get(key)
+            if cached is not None:
+                return cached
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            try:
+                return future.result(timeout=30)
+            except Exception:
+                logging.warning(f"Ожидание параллельного поиска не удалось: '{key}'")
+                return None
+
+        result = None
+        try:
+            result = self._search_uncached(query, query_lower)
+        finally:
+            if result is not None:
+                # Неудачи не кэшируем, чтобы не прятать восстановление провайдеров
+                with self._cache_lock:
+                    self._search_cache[key] = result
+            else:
+                # Если совсем ничего не найдено, возвращаем информационное сообщение
+                result = f"🔍 **Поиск информации в интернете**\n\nК сожалению, в данный момент не удалось получить актуальную информацию по запросу '{query}' из доступных источников. Это может быть связано с временными ограничениями доступа к внешним сервисам."
+
+            with self._cache_lock:
+                self._inflight.pop(key, None)
+            future.set_result(result)
+
+        return result
+
+    async def search_async(self, query: str) -> Optional[str]:
+        """Асинхронная обёртка над search для вызова из event loop
+
+        Синхронный search блокирует поток на время сетевых запросов;
+        из асинхронного кода он выполняется в общем пуле _POOL, не
+        останавливая event loop. Число одновременных поисков ограничено
+        размером пула.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_POOL, self.search, query)
+
+    def _search_uncached(self, query: str, query_lower: Optional[str] = None) -> Optional[str]:
+        """Опрос провайдеров без учёта кэша"""
+        if query_lower is None:
+            query_lower = query.lower()
+
+        # Специализированные запросы маршрутизируются напрямую: погодный
+        # вопрос не тратит HTTP-раундтрип на Яндекс/Perplexity, которые
+        # всё равно ответят хуже профильного источника
+        dispatched = None
+        for pattern, handler_name in _DISPATCH:
+            if pattern.search(query_lower):
+                result = getattr(self, handler_name)(query)
+                if result:
+                    return result
+                # Профильный провайдер промахнулся — идём по общему
+                # каскаду, не опрашивая его повторно
+                dispatched = handler_name
+                break
+
+        # Сначала пробуем платные API если есть ключи. При обоих ключах
+        # Яндекс и Perplexity опрашиваются одновременно — выигрывает
+        # первый непустой ответ, а не сумма двух таймаутов
+        paid_providers = []
         if self.yandex_api_key:
-            result = self._search_yandex(query)
-            if result:
-                return result
-                
+            paid_providers.append(self._search_yandex)
         if self.perplexity_api_key:
-            result = self._search_perplexity(query)
+            paid_providers.append(self._search_perplexity)
+
+        if paid_providers:
+            result = self._parallel_search(paid_providers, query)
             if result:
                 return result
-        
+
+
+        # Бесплатные источники опрашиваются параллельно: суммарное время —
+        # это самый быстрый удачный ответ, а не сумма таймаутов всех провайдеров
+        providers = []
+
         # Специальная обработка для погодных запросов
-        if any(word in query.lower() for word in ['погода', 'температура', 'прогноз', 'климат']):
-            result = self._search_weather_info(query)
-            if result:
-                return result
-        
+        if dispatched != '_search_weather_info' and _WEATHER_RE.search(query_lower):
+            providers.append(
+                functools.partial(self._search_weather_info, query_lower=query_lower)
+            )
+
         # Для энциклопедических запросов - Wikipedia
-        if any(word in query.lower() for word in ['что такое', 'кто такой', 'определение', 'история']):
-            result = self._search_wikipedia(query)
-            if result:
-                return result
-        
-        # Основной поиск через DuckDuckGo
-        result = self._search_duckduckgo(query)
-        if result:
-            return result
-        
-        # Если ничего не найдено, попробуем Wikipedia как запасной вариант
-        result = self._search_wikipedia(query)
-        if result:
-            return result
-        
-        # Если совсем ничего не найдено, возвращаем информационное сообщение
-        return f"🔍 **Поиск информации в интернете**\n\nК сожалению, в данный момент не удалось получить актуальную информацию по запросу '{query}' из доступных источников. Это может быть связано с временными ограничениями доступа к внешним сервисам."
+        if dispatched != '_search_wikipedia' and _WIKI_RE.search(query_lower):
+            providers.append(self._search_wikipedia)
+
+        # Основной поиск через DuckDuckGo, Wikipedia как запасной вариант
+        providers.append(self._search_duckduckgo)
+        if dispatched != '_search_wikipedia' and self._search_wikipedia not in providers:
+            providers.append(self._search_wikipedia)
+
+        return self._parallel_search(providers, query)
+
+    def _parallel_search(self, providers, query: str, timeout: float = 20) -> Optional[str]:
+        """Параллельный опрос провайдеров поиска
+
+        Возвращает первый непустой результат; оставшиеся задачи отменяются,
+        чтобы не держать пул на медленных провайдерах.
+        """
+        futures = [_POOL.submit(provider, query) for provider in providers]
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.warning(f"Провайдер поиска завершился с ошибкой: {str(e)}")
+                    continue
+                if result:
+                    for other in futures:
+                        other.cancel()
+                    return result
+        except FuturesTimeoutError:
+            logging.warning(f"Параллельный поиск превысил таймаут {timeout}с")
+        return None
     
+    def _request_with_backoff(self, method: str, url: str, max_retries: int = 3, **kwargs):
+        """HTTP-запрос с экспоненциальным backoff и джиттером
+
+        Повторяются только временные сбои: 429/5xx и сетевые ошибки,
+        с уважением к заголовку Retry-After. Остальные 4xx возвращаются
+        сразу — повторять их бессмысленно.
+        """
+        last_exc = None
+        response = None
+        for attempt in range(max_retries):
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                last_exc = e
+                if attempt < max_retries - 1:
+                    time.sleep(min(30, 2 ** attempt * (1 + random.random() * 0.5)))
+                continue
+
+            if response.status_code in _RETRY_STATUSES and attempt < max_retries - 1:
+                try:
+                    delay = float(response.headers.get('Retry-After', 0))
+                except ValueError:
+                    delay = 0.0
+                if not delay:
+                    delay = 2 ** attempt * (1 + random.random() * 0.5)
+                time.sleep(min(delay, 30))
+                continue
+
+            return response
+
+        if response is None and last_exc is not None:
+            raise last_exc
+        return response
+
+    def _breaker_open(self, name: str) -> bool:
+        """Открыт ли предохранитель провайдера (провайдер пропускается)"""
+        if time.time() < self._breakers[name]['open_until']:
+            logging.debug(f"Провайдер {name} пропущен: предохранитель открыт")
+            return True
+        return False
+
+    def _breaker_record(self, name: str, ok: bool) -> None:
+        """Учёт исхода обращения к провайдеру
+
+        Сбоем считаются сетевые ошибки и статусы из _RETRY_STATUSES;
+        осмысленные 4xx (например, 404 от Wikipedia) провайдеру не
+        засчитываются. После _BREAKER_FAILS подряд сбоев провайдер
+        выключается на _BREAKER_COOLDOWN секунд.
+        """
+        with self._breaker_lock:
+            br = self._breakers[name]
+            if ok:
+                br['fails'] = 0
+                br['open_until'] = 0.0
+            else:
+                br['fails'] += 1
+                if br['fails'] >= _BREAKER_FAILS:
+                    br['open_until'] = time.time() + _BREAKER_COOLDOWN
+                    logging.warning(
+                        f"Провайдер {name} отключён на {_BREAKER_COOLDOWN}с "
+                        f"после {br['fails']} сбоев подряд"
+                    )
+
     def _search_perplexity(self, query: str) -> Optional[str]:
         """Поиск через Perplexity API"""
+        if self._breaker_open('perplexity'):
+            return None
         try:
             url = "https://api.perplexity.ai/chat/completions"
             
@@ -71,31 +447,22 @@ class SearchService:
                 'Content-Type': 'application/json'
             }
             
-            payload = {
-                "model": "llama-3.1-sonar-small-128k-online",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "Ты помощник для поиска актуальной информации. Отвечай кратко и точно на русском языке."
-                    },
-                    {
-                        "role": "user", 
-                        "content": query
-                    }
-                ],
-                "max_tokens": 500,
-                "temperature": 0.2,
-                "top_p": 0.9,
-                "return_images": False,
-                "return_related_questions": False,
-                "search_recency_filter": "month",
-                "stream": False
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=20)
-            
+            # Неглубокая копия скелета; подменяется только сообщение
+            # пользователя. Сериализация через orjson — httpx не гоняет
+            # payload через stdlib json
+            payload = _PERPLEXITY_BASE.copy()
+            payload['messages'] = [
+                _PERPLEXITY_BASE['messages'][0],
+                {"role": "user", "content": query}
+            ]
+
+            response = self._request_with_backoff(
+                'POST', url, headers=headers, content=orjson.dumps(payload)
+            )
+            self._breaker_record('perplexity', response.status_code not in _RETRY_STATUSES)
+
             if response.status_code == 200:
-                result = response.json()
+                result = _decode_json(response)
                 if 'choices' in result and len(result['choices']) > 0:
                     content = result['choices'][0]['message']['content']
                     
@@ -110,11 +477,14 @@ class SearchService:
             return None
             
         except Exception as e:
+            self._breaker_record('perplexity', False)
             logging.warning(f"Ошибка Perplexity API: {str(e)}")
             return None
     
     def _search_duckduckgo(self, query: str) -> Optional[str]:
         """Бесплатный поиск через DuckDuckGo Instant Answer API"""
+        if self._breaker_open('ddg'):
+            return None
         try:
             # DuckDuckGo Instant Answer API - полностью бесплатный
             encoded_query = urllib.parse.quote(query)
@@ -124,11 +494,12 @@ class SearchService:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.get(url, headers=headers, timeout=15)
-            
+            response = self._request_with_backoff('GET', url, headers=headers)
+            self._breaker_record('ddg', response.status_code not in _RETRY_STATUSES)
+
             if response.status_code == 200:
-                data = response.json()
-                
+                data = _decode_json(response)
+
                 # Формируем ответ из доступных данных
                 result_parts = []
                 
@@ -140,12 +511,16 @@ class SearchService:
                 if data.get('Definition'):
                     result_parts.append(f"📖 **Определение:**\n{data['Definition']}")
                 
-                # Связанные темы
+                # Связанные темы: ранний выход после трёх найденных, а не
+                # срез первых трёх элементов — в начале списка часто идут
+                # группы-рубрикаторы без поля Text
                 if data.get('RelatedTopics'):
                     topics = []
-                    for topic in data['RelatedTopics'][:3]:
+                    for topic in data['RelatedTopics']:
                         if isinstance(topic, dict) and topic.get('Text'):
                             topics.append(f"• {topic['Text'][:100]}...")
+                            if len(topics) >= 3:
+                                break
                     if topics:
                         result_parts.append(f"🔗 **Связанные темы:**\n" + "\n".join(topics))
                 
@@ -165,25 +540,46 @@ class SearchService:
             return None
             
         except Exception as e:
+            self._breaker_record('ddg', False)
             logging.error(f"Ошибка при поиске DuckDuckGo: {str(e)}")
             return None
     
     def _search_wikipedia(self, query: str) -> Optional[str]:
-        """Поиск в Wikipedia API (бесплатно)"""
+        """Поиск в Wikipedia API (бесплатно, с суточным кэшем)"""
+        key = query.strip().lower()
+        with self._cache_lock:
+            cached = self._wiki_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = self._fetch_wikipedia(query)
+        if result:
+            with self._cache_lock:
+                self._wiki_cache[key] = result
+        return result
+
+    def _fetch_wikipedia(self, query: str) -> Optional[str]:
+        """Запрос к Wikipedia API"""
+        if self._breaker_open('wiki'):
+            return None
         try:
-            # Wikipedia API - полностью бесплатный
-            encoded_query = urllib.parse.quote(query)
+            # Wikipedia API - полностью бесплатный. REST-endpoint ждёт
+            # заголовок статьи с подчёркиваниями вместо пробелов; полное
+            # URL-экранирование приводило к лишнему редиректу
+            title = query.strip().replace(' ', '_')
+            encoded_query = urllib.parse.quote(title, safe='/_:')
             url = f"https://ru.wikipedia.org/api/rest_v1/page/summary/{encoded_query}"
             
             headers = {
                 'User-Agent': 'Mozilla/5.0 (ChatBot/1.0)'
             }
             
-            response = requests.get(url, headers=headers, timeout=10)
-            
+            response = self._request_with_backoff('GET', url, headers=headers)
+            self._breaker_record('wiki', response.status_code not in _RETRY_STATUSES)
+
             if response.status_code == 200:
-                data = response.json()
-                
+                data = _decode_json(response)
+
                 if data.get('extract'):
                     title = data.get('title', 'Статья')
                     extract = data['extract']
@@ -198,11 +594,78 @@ class SearchService:
             return None
             
         except Exception as e:
+            self._breaker_record('wiki', False)
             logging.error(f"Ошибка при поиске Wikipedia: {str(e)}")
             return None
-    
+
+    def _search_wikipedia_many(self, queries) -> Dict[str, Optional[str]]:
+        """Пакетный запрос выдержек Wikipedia одним вызовом action-API
+
+        prop=extracts отдаёт до 50 статей за запрос — вместо N
+        обращений к REST-endpoint по одному. Возвращает словарь
+        запрос -> форматированный ответ (None, если статьи нет);
+        найденное попадает в суточный кэш наравне с одиночным поиском.
+        """
+        results = {query: None for query in queries}
+        if not results or self._breaker_open('wiki'):
+            return results
+
+        # Сопоставление нормализованного заголовка с исходным запросом,
+        # чтобы разобрать ответ обратно по запросам
+        by_title = {query.strip().replace('_', ' ').lower(): query for query in results}
+        try:
+            params = {
+                'action': 'query',
+                'prop': 'extracts',
+                'exintro': 1,
+                'explaintext': 1,
+                'redirects': 1,
+                'titles': '|'.join(q.strip().replace(' ', '_') for q in results),
+                'format': 'json',
+                'formatversion': 2
+            }
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (ChatBot/1.0)'
+            }
+
+            response = self._request_with_backoff(
+                'GET', "https://ru.wikipedia.org/w/api.php", params=params, headers=headers
+            )
+            self._breaker_record('wiki', response.status_code not in _RETRY_STATUSES)
+
+            if response.status_code != 200:
+                return results
+
+            data = _decode_json(response).get('query', {})
+
+            # API нормализует и редиректит заголовки — прослеживаем
+            # цепочку обратно к исходному запросу
+            for step in data.get('normalized', []) + data.get('redirects', []):
+                source = by_title.pop(step.get('from', '').lower(), None)
+                if source is not None:
+                    by_title[step.get('to', '').lower()] = source
+
+            for page in data.get('pages', []):
+                extract = page.get('extract')
+                query = by_title.get(page.get('title', '').lower())
+                if not extract or query is None:
+                    continue
+                result = f"🔍 **Информация из Wikipedia:**\n\n📖 **{page['title']}**\n\n{extract}"
+                results[query] = result
+                with self._cache_lock:
+                    self._wiki_cache[query.strip().lower()] = result
+
+            return results
+
+        except Exception as e:
+            self._breaker_record('wiki', False)
+            logging.error(f"Ошибка при пакетном поиске Wikipedia: {str(e)}")
+            return results
+
     def _search_yandex(self, query: str) -> Optional[str]:
         """Поиск через Яндекс.Поиск API"""
+        if self._breaker_open('yandex'):
+            return None
         try:
             # Яндекс XML API для поиска
             base_url = "https://yandex.com/search/xml"
@@ -219,36 +682,43 @@ class SearchService:
                 'groupby': 'attr%3Dd.mode%3Ddeep.groups-on-page%3D5.docs-in-group%3D1'
             }
             
-            response = requests.get(base_url, params=params, timeout=15)
-            
+            response = self._request_with_backoff('GET', base_url, params=params)
+            self._breaker_record('yandex', response.status_code not in _RETRY_STATUSES)
+
             if response.status_code == 200:
-                # Парсим XML ответ
-                import xml.etree.ElementTree as ET
-                
-                root = ET.fromstring(response.content)
+                # Инкрементальный разбор XML на C-уровне: документы
+                # обрабатываются и освобождаются по одному, полное дерево
+                # выдачи в памяти не строится
+                from lxml import etree
+
                 results = []
-                
-                # Извлекаем результаты поиска
-                for group in root.findall('.//group'):
-                    for doc in group.findall('.//doc'):
-                        title_elem = doc.find('.//title')
-                        url_elem = doc.find('.//url')
-                        passage_elem = doc.find('.//passage')
-                        
-                        if title_elem is not None and passage_elem is not None:
-                            title = title_elem.text or ''
-                            url = url_elem.text if url_elem is not None else ''
-                            passage = passage_elem.text or ''
-                            
-                            # Очищаем от HTML тегов
-                            title = re.sub(r'<[^>]+>', '', title)
-                            passage = re.sub(r'<[^>]+>', '', passage)
-                            
-                            results.append({
-                                'title': title,
-                                'url': url,
-                                'snippet': passage
-                            })
+
+                for _, doc in etree.iterparse(BytesIO(response.content), tag='doc'):
+                    title_elem = doc.find('.//title')
+                    url_elem = doc.find('.//url')
+                    passage_elem = doc.find('.//passage')
+
+                    if title_elem is not None and passage_elem is not None:
+                        url = url_elem.text if url_elem is not None else ''
+
+                        # tostring(method='text') собирает текст без
+                        # вложенных тегов подсветки (<hlword> и т.п.)
+                        title = etree.tostring(
+                            title_elem, method='text', encoding='unicode'
+                        ).strip()
+                        passage = etree.tostring(
+                            passage_elem, method='text', encoding='unicode'
+                        ).strip()
+
+                        results.append({
+                            'title': title,
+                            'url': url,
+                            'snippet': passage
+                        })
+
+                    # Освобождаем разобранный элемент, чтобы память
+                    # не росла с размером выдачи
+                    doc.clear()
                 
                 if results:
                     result_text = "🔍 **Результаты поиска Яндекс:**\n\n"
@@ -266,95 +736,52 @@ class SearchService:
             return None
             
         except Exception as e:
+            self._breaker_record('yandex', False)
             logging.warning(f"Ошибка Яндекс API: {str(e)}")
             return None
     
-    def _search_weather_info(self, query: str) -> Optional[str]:
+    def _search_weather_info(self, query: str, query_lower: Optional[str] = None) -> Optional[str]:
         """Поиск информации о погоде через различные источники"""
         try:
-            # Определяем город из запроса
-            query_lower = query.lower()
+            # Определяем город из запроса (нормализация уже сделана в search)
+            if query_lower is None:
+                query_lower = query.lower()
             city = "Moscow"  # По умолчанию
             city_name_ru = "Москве"  # Для отображения
-            
-            # Словарь городов для более точного определения
-            cities_map = {
-                # Основные города
-                "москва": ("Moscow", "Москве"),
-                "moscow": ("Moscow", "Москве"),
-                "питер": ("Saint Petersburg", "Санкт-Петербурге"),
-                "спб": ("Saint Petersburg", "Санкт-Петербурге"),
-                "санкт-петербург": ("Saint Petersburg", "Санкт-Петербурге"),
-                "екатеринбург": ("Yekaterinburg", "Екатеринбурге"),
-                "новосибирск": ("Novosibirsk", "Новосибирске"),
-                "казань": ("Kazan", "Казани"),
-                "казан": ("Kazan", "Казани"),
-                "ростов": ("Rostov-on-Don", "Ростове-на-Дону"),
-                "краснодар": ("Krasnodar", "Краснодаре"),
-                "тула": ("Tula", "Туле"),
-                "туле": ("Tula", "Туле"),
-                "новомосковск": ("Novomoskovsk", "Новомосковске"),
-                "якутск": ("Yakutsk", "Якутске"),
-                "якутии": ("Yakutsk", "Якутии"),
-                "мурманск": ("Murmansk", "Мурманске"),
-                # Дальневосточные города
-                "усурийск": ("Ussuriysk", "Усурийске"),
-                "владивосток": ("Vladivostok", "Владивостоке"),
-                "хабаровск": ("Khabarovsk", "Хабаровске"),
-                "благовещенск": ("Blagoveshchensk", "Благовещенске"),
-                "южно-сахалинск": ("Yuzhno-Sakhalinsk", "Южно-Сахалинске"),
-                "петропавловск-камчатский": ("Petropavlovsk-Kamchatsky", "Петропавловске-Камчатском"),
-                # Сибирские города
-                "омск": ("Omsk", "Омске"),
-                "красноярск": ("Krasnoyarsk", "Красноярске"),
-                "барнаул": ("Barnaul", "Барнауле"),
-                "кемерово": ("Kemerovo", "Кемерово"),
-                "томск": ("Tomsk", "Томске"),
-                "иркутск": ("Irkutsk", "Иркутске"),
-                "улан-удэ": ("Ulan-Ude", "Улан-Удэ"),
-                "чита": ("Chita", "Чите"),
-                # Южные города
-                "волгоград": ("Volgograd", "Волгограде"),
-                "сочи": ("Sochi", "Сочи"),
-                "ставрополь": ("Stavropol", "Ставрополе"),
-                "астрахань": ("Astrakhan", "Астрахани"),
-                # Поволжье
-                "нижний новгород": ("Nizhny Novgorod", "Нижнем Новгороде"),
-                "самара": ("Samara", "Самаре"),
-                "уфа": ("Ufa", "Уфе"),
-                "пермь": ("Perm", "Перми"),
-                "саратов": ("Saratov", "Саратове"),
-                # Центральные города
-                "воронеж": ("Voronezh", "Воронеже"),
-                "тверь": ("Tver", "Твери"),
-                "ярославль": ("Yaroslavl", "Ярославле"),
-                "рязань": ("Ryazan", "Рязани")
-            }
-            
-            # Ищем город в запросе
-            for city_key, (city_eng, city_ru) in cities_map.items():
-                if city_key in query_lower:
-                    city = city_eng
-                    city_name_ru = city_ru
-                    break
-            
+
+            # Один проход по запросу; самое длинное совпадение выигрывает
+            # за счёт порядка альтернатив в _CITY_RE
+            match = _CITY_RE.search(query_lower)
+            if match:
+                city, city_name_ru = _CITIES_MAP[match.group(0)]
+
+            # Разные формулировки про один город попадают в один кэш:
+            # не больше одного запроса к wttr.in на город в 10 минут
+            cache_key = (city, city_name_ru)
+            with self._cache_lock:
+                cached = self._weather_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
             # Попытка через wttr.in - бесплатный сервис погоды
-            try:
-                weather_url = f"https://wttr.in/{city}?format=j1"
-                response = requests.get(weather_url, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    current = data.get('current_condition', [{}])[0]
-                    
-                    if current:
-                        temp = current.get('temp_C', 'N/A')
-                        feels_like = current.get('FeelsLikeC', 'N/A')
-                        humidity = current.get('humidity', 'N/A')
-                        wind = current.get('windspeedKmph', 'N/A')
-                        desc = current.get('weatherDesc', [{}])[0].get('value', 'N/A')
-                        
-                        weather_info = f"""🌤️ **Актуальная погода в {city_name_ru}:**
+            if not self._breaker_open('wttr'):
+                try:
+                    weather_url = f"https://wttr.in/{city}?format=j1"
+                    response = self._request_with_backoff('GET', weather_url)
+                    self._breaker_record('wttr', response.status_code not in _RETRY_STATUSES)
+
+                    if response.status_code == 200:
+                        data = _decode_json(response)
+                        current = data.get('current_condition', [{}])[0]
+
+                        if current:
+                            temp = current.get('temp_C', 'N/A')
+                            feels_like = current.get('FeelsLikeC', 'N/A')
+                            humidity = current.get('humidity', 'N/A')
+                            wind = current.get('windspeedKmph', 'N/A')
+                            desc = current.get('weatherDesc', [{}])[0].get('value', 'N/A')
+
+                            weather_info = f"""🌤️ **Актуальная погода в {city_name_ru}:**
 
 **Сейчас:** {temp}°C (ощущается как {feels_like}°C)
 **Описание:** {desc}
@@ -362,10 +789,14 @@ class SearchService:
 **Ветер:** {wind} км/ч
 
 📊 **Источник:** wttr.in - актуальные метеоданные"""
-                        
-                        return weather_info
-            except:
-                pass
+
+                            # Кэшируем только реальные данные; текст-заглушка
+                            # ниже не должен прятать восстановление wttr.in
+                            with self._cache_lock:
+                                self._weather_cache[cache_key] = weather_info
+                            return weather_info
+                except Exception:
+                    self._breaker_record('wttr', False)
             
             # Fallback для случаев когда API недоступен
             return f"""🌤️ **Информация о погоде в {city_name_ru}:**
@@ -387,48 +818,10 @@ class SearchService:
         """Определяет, нужен ли поиск для данного сообщения"""
         if not self.enabled:
             return False
-            
-        # Ключевые слова, указывающие на необходимость поиска
-        search_indicators = [
-            # Временные индикаторы
-            "последние новости", "свежие новости", "что происходит",
-            "актуальная информация", "сегодня", "вчера", "недавно",
-            "текущий", "сейчас", "в настоящее время", "на данный момент",
-            "2024", "2025", "этот год", "в этом году", "в прошлом году",
-            
-            # Финансовая и экономическая информация
-            "курс", "цена", "стоимость", "котировки", "биржа", "акции",
-            "криптовалюта", "биткоин", "доллар", "евро", "рубль",
-            "инфляция", "экономика", "ВВП", "бюджет",
-            
-            # Погода и география
-            "погода", "прогноз", "температура", "климат", "дождь", "снег",
-            "ветер", "давление", "влажность",
-            
-            # Новости и события
-            "что нового", "обновления", "изменения", "события", "произошло",
-            "случилось", "новость", "сообщают", "объявили", "заявили",
-            
-            # Информационные запросы
-            "что такое", "кто такой", "определение", "история", "биография",
-            "расскажи о", "информация о", "данные о", "статистика",
-            "рейтинг", "топ", "список", "обзор",
-            
-            # Технологии и наука
-            "последняя версия", "обновление", "выпуск", "релиз",
-            "исследование", "открытие", "изобретение", "патент",
-            
-            # Спорт и культура
-            "результаты", "счет", "матч", "игра", "чемпионат",
-            "фильм", "сериал", "книга", "музыка", "премьера",
-            
-            # Места и организации
-            "работает", "открыт", "закрыт", "расписание", "адрес",
-            "телефон", "сайт", "контакты", "время работы"
-        ]
-        
-        message_lower = message.lower()
-        return any(indicator in message_lower for indicator in search_indicators)
+
+        # Один проход предкомпилированного regex по сообщению вместо
+        # перебора всех индикаторов по очереди
+        return bool(_SEARCH_RE.search(message))
     
     def get_status(self) -> Dict[str, Any]:
         """Получение статуса сервиса поиска"""
@@ -115,19 +115,31 @@ class ChatApp {
         this.showLoading();
         
         try {
-            const response = await fetch('/api/chat', {
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({ message: message })
             });
-            
+
+            const contentType = response.headers.get('Content-Type') || '';
+
+            // Текстовые ответы приходят SSE-потоком и дорисовываются по токенам
+            if (response.ok && contentType.includes('text/event-stream')) {
+                await this.readStream(response);
+                return;
+            }
+
             const data = await response.json();
-            
+
             if (response.ok) {
                 // Проверяем, есть ли изображение в ответе
-                if (data.type === 'image' && data.image_url) {
+                if (data.type === 'image_pending' && data.job_id) {
+                    // Генерация ушла в фон — показываем статус и опрашиваем задачу
+                    this.addMessage(data.response, 'bot');
+                    this.pollImageJob(data.job_id);
+                } else if (data.type === 'image' && data.image_url) {
                     this.addImageMessage(data.response, data.image_url, data.prompt, data.service);
                 } else {
                     // Добавляем обычный текстовый ответ
@@ -153,6 +165,113 @@ class ChatApp {
         }
     }
     
+    async pollImageJob(jobId) {
+        // Опрашиваем фоновую генерацию каждые 500 мс (не дольше минуты)
+        for (let attempt = 0; attempt < 120; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 500));
+
+            try {
+                const response = await fetch(`/api/image/${jobId}`);
+                const data = await response.json();
+
+                if (data.status === 'pending') {
+                    continue;
+                }
+
+                if (data.status === 'finished' && data.type === 'image' && data.image_url) {
+                    this.addImageMessage(data.response, data.image_url, data.prompt, data.service);
+                } else {
+                    this.addMessage(
+                        data.response || 'Не удалось сгенерировать изображение',
+                        'bot',
+                        'error'
+                    );
+                }
+                return;
+            } catch (error) {
+                console.error('Ошибка при опросе задачи генерации:', error);
+            }
+        }
+
+        this.addMessage('Генерация изображения заняла слишком много времени', 'bot', 'error');
+    }
+
+    async readStream(response) {
+        // Создаём пустое сообщение бота и дополняем его по мере прихода токенов
+        this.hideLoading();
+        const bubble = this.createStreamingMessage();
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let fullText = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE-кадры разделяются пустой строкой
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                if (!frame.startsWith('data: ')) {
+                    continue;
+                }
+                const payload = frame.slice(6);
+                if (payload === '[DONE]') {
+                    continue;
+                }
+                try {
+                    const chunk = JSON.parse(payload);
+                    if (chunk.delta) {
+                        fullText += chunk.delta;
+                        bubble.innerHTML = this.formatMessage(fullText);
+                        this.scrollToBottom();
+                    }
+                } catch (e) {
+                    // Пропускаем повреждённый кадр
+                }
+            }
+        }
+
+        this.messageHistory.push({ content: fullText, sender: 'bot', timestamp: new Date() });
+    }
+
+    createStreamingMessage() {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message bot-message';
+
+        const avatarDiv = document.createElement('div');
+        avatarDiv.className = 'message-avatar';
+        avatarDiv.innerHTML = '<i class="fas fa-robot"></i>';
+
+        const contentDiv = document.createElement('div');
+        contentDiv.className = 'message-content';
+
+        const bubbleDiv = document.createElement('div');
+        bubbleDiv.className = 'message-bubble';
+
+        const timeDiv = document.createElement('div');
+        timeDiv.className = 'message-time';
+        timeDiv.textContent = this.formatTime(new Date());
+
+        contentDiv.appendChild(bubbleDiv);
+        contentDiv.appendChild(timeDiv);
+
+        messageDiv.appendChild(avatarDiv);
+        messageDiv.appendChild(contentDiv);
+
+        this.chatMessages.appendChild(messageDiv);
+        messageDiv.style.opacity = '1';
+        this.scrollToBottom();
+
+        return bubbleDiv;
+    }
+
     addMessage(content, sender, type = 'normal') {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${sender}-message`;